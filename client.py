@@ -1,35 +1,110 @@
-import base64
 import hashlib
+import io
 import json
+import os
 import re
+import tempfile
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from pathlib import Path
+from typing import BinaryIO, Callable
 
+import orjson
+import pandas as pd
 import streamlit as st
-import requests
-from PIL import Image
-import io
-from pathlib import Path
-from utils.ollama_client import generate_text
+
+try:  # C Aho-Corasick; optional, a regex alternation is the fallback
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
 
 from utils.ollama_client import generate_with_image
-# from core.recipe import chat_with_chef
-# from core.recipe import ingredients_to_recipe
 from core.recipe import stream_chef_response
 
 
 # ── INVENTORY HELPERS ─────────────────────────────────────────────────────────
 INVENTORY_FILE = Path("inventory.json")
 
-def load_inventory() -> list:
-    if not INVENTORY_FILE.exists():
+@st.cache_data(show_spinner=False)
+def _read_json_list(path: str, mtime_ns: int) -> list:
+    """Parse a JSON list file; cached until the file's mtime changes."""
+    return orjson.loads(Path(path).read_bytes())
+
+def _load_json_list(path: Path) -> list:
+    try:
+        mtime_ns = path.stat().st_mtime_ns
+    except FileNotFoundError:
         return []
-    return json.loads(INVENTORY_FILE.read_text())
+    return _read_json_list(str(path), mtime_ns)
+
+def _save_json_list(path: Path, items: list):
+    """Atomically replace a JSON list file and drop the read cache.
+
+    Skips the write entirely when the file already holds the same bytes.
+    """
+    data = orjson.dumps(items)
+    try:
+        if path.read_bytes() == data:
+            return
+    except FileNotFoundError:
+        pass
+    # A unique temp file per write, so concurrent saves never share one.
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            # Data must be on disk before the rename, or a crash can leave
+            # the replaced file empty.
+            f.flush()
+            os.fsync(f.fileno())
+        try:  # mkstemp() creates the file 0600; keep the existing file's mode
+            os.chmod(tmp, path.stat().st_mode)
+        except FileNotFoundError:
+            pass
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    _read_json_list.clear()
+
+def load_inventory() -> list:
+    return _load_json_list(INVENTORY_FILE)
 
 def save_inventory(items: list):
-    INVENTORY_FILE.write_text(json.dumps(items))
+    _save_json_list(INVENTORY_FILE, items)
+
+def _set_inventory(items: list):
+    """Stage an inventory edit; flushed to disk once per rerun."""
+    st.session_state.inventory = items
+    st.session_state.inventory_dirty = True
+
+def _remove_selected_inventory():
+    to_remove = set(st.session_state.inventory_remove)
+    _set_inventory([i for i in st.session_state.inventory if i not in to_remove])
+    st.session_state.inventory_remove = []
+
+def _add_to_inventory():
+    """Merge the still-ticked scan review rows into the inventory.
+
+    Reads the editor state at click time; a render-time button arg would
+    miss an untick made just before the click.
+    """
+    edits = st.session_state.get("scan_review", {}).get("edited_rows", {})
+    items = [
+        item for row, item in enumerate(st.session_state.pending_scan or [])
+        if edits.get(row, {}).get("keep", True)
+    ]
+    merged = merge_ingredients(st.session_state.inventory, items)
+    _set_inventory(merged)
+    st.session_state.pending_scan = None
+    st.toast(f"✅ {len(items)} ingredients added. Inventory now has {len(merged)} items.")
 
 def merge_ingredients(existing: list, new_items: list) -> list:
-    combined = {item.lower().strip() for item in existing + new_items}
-    return sorted(combined)
+    return sorted({
+        s for s in map(str.strip, map(str.lower, chain(existing, new_items))) if s
+    })
 # ──────────────────────────────────────────────────────────────────────────────
 
 # ── SHOPPING LIST HELPERS ─────────────────────────────────────────────────────
@@ -38,12 +113,17 @@ from core.recipe import extract_recipe_ingredients  # noqa: E402
 SHOPPING_LIST_FILE = Path("shopping_list.json")
 
 def load_shopping_list() -> list:
-    if not SHOPPING_LIST_FILE.exists():
-        return []
-    return json.loads(SHOPPING_LIST_FILE.read_text())
+    return _load_json_list(SHOPPING_LIST_FILE)
 
 def save_shopping_list(items: list):
-    SHOPPING_LIST_FILE.write_text(json.dumps(items))
+    _save_json_list(SHOPPING_LIST_FILE, items)
+
+def _remove_shopping_item(item: str):
+    save_shopping_list([i for i in load_shopping_list() if i != item])
+
+def _add_to_shopping_list(items: list):
+    save_shopping_list(sorted(set(load_shopping_list()) | set(items)))
+    st.toast(f"✅ Added {len(items)} item(s) to your shopping list.")
 
 _PANTRY_STAPLES = {
     "salt", "pepper", "black pepper", "white pepper", "oil", "olive oil",
@@ -51,18 +131,237 @@ _PANTRY_STAPLES = {
     "soy sauce", "vinegar", "baking soda", "baking powder",
 }
 
+_PANTRY_STAPLES_RE = re.compile("|".join(map(re.escape, _PANTRY_STAPLES)))
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def _inventory_matcher(inv_key: tuple[str, ...]) -> tuple[Callable[[str], object], str]:
+    """Build the substring matchers for a sorted, lowercased, non-empty inventory.
+
+    Returns a predicate that is truthy when any inventory item occurs
+    inside a recipe ingredient, plus a NUL-joined haystack for the reverse
+    check (recipe ingredient inside an inventory item). The predicate is
+    an Aho-Corasick automaton when pyahocorasick is installed, else a
+    compiled regex alternation. Cached with st.cache_resource so the
+    matcher survives reruns instead of being rebuilt on every one.
+    """
+    contains_item: Callable[[str], object]
+    if ahocorasick is not None:
+        automaton = ahocorasick.Automaton()
+        for item in inv_key:
+            automaton.add_word(item, item)
+        automaton.make_automaton()
+
+        def _automaton_contains(text: str) -> bool:
+            return next(automaton.iter(text), None) is not None
+
+        contains_item = _automaton_contains
+    else:
+        contains_item = re.compile("|".join(map(re.escape, inv_key))).search
+    return contains_item, "\0".join(inv_key)
+
 def get_missing_ingredients(recipe_ings: list[str], inventory: list[str]) -> list[str]:
-    inv_set = {item.lower() for item in inventory}
+    inv_set = frozenset(item.lower() for item in inventory if item)
+    if not inv_set:
+        return [
+            ing for ing in recipe_ings
+            if not _PANTRY_STAPLES_RE.search(ing.lower())
+        ]
+    contains_item, inv_haystack = _inventory_matcher(tuple(sorted(inv_set)))
     missing = []
     for ing in recipe_ings:
         ing_lower = ing.lower()
-        if any(staple in ing_lower for staple in _PANTRY_STAPLES):
+        if _PANTRY_STAPLES_RE.search(ing_lower):
+            continue
+        if ing_lower in inv_haystack or contains_item(ing_lower):
             continue
-        if not any(ing_lower in inv_item or inv_item in ing_lower for inv_item in inv_set):
-            missing.append(ing)
+        missing.append(ing)
     return missing
 # ──────────────────────────────────────────────────────────────────────────────
 
+# ── SCAN HELPERS ──────────────────────────────────────────────────────────────
+# The vision model downsizes to well under this edge anyway, so anything
+# larger is wasted base64, network, and encoder work.
+SCAN_MAX_EDGE = 768
+SCAN_JPEG_QUALITY = 85
+
+def downsample_for_scan(image_file: BinaryIO) -> bytes:
+    """Shrink an image file to SCAN_MAX_EDGE and re-encode it as JPEG."""
+    # Pillow is only needed once per upload; keep it off chat-only reruns.
+    from PIL import Image, ImageOps
+
+    image_file.seek(0)
+    img: Image.Image = Image.open(image_file)
+    # Re-encoding drops EXIF, so bake the camera orientation in first.
+    img = ImageOps.exif_transpose(img)
+    img.thumbnail((SCAN_MAX_EDGE, SCAN_MAX_EDGE), Image.Resampling.LANCZOS)
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=SCAN_JPEG_QUALITY)
+    return buf.getvalue()
+
+SCAN_PROMPT = (
+    "You are a food inventory scanner. Look at this fridge image carefully.\n\n"
+    "List only the food items you can clearly and confidently identify. "
+    "Be conservative — if you are not sure, leave it out.\n\n"
+    "Rules:\n"
+    "- Output ONLY a JSON array of strings, nothing else\n"
+    "- Each string is a single food item (e.g. \"apple\", \"milk\", \"eggs\")\n"
+    "- No adjectives, quantities, or descriptions\n"
+    "- No packaging, containers, or kitchen tools\n"
+    "- No items you are uncertain about\n\n"
+    "Example: [\"apple\", \"milk\", \"eggs\", \"cheddar cheese\"]\n\n"
+    "JSON array:"
+)
+
+_JSON_DECODER = json.JSONDecoder()
+
+def parse_scan_items(raw: str) -> list[str]:
+    """Turn the vision model's reply into a list of lowercased item names."""
+    # Try JSON parsing first, fall back to comma-split
+    new_items = []
+    try:
+        parsed = orjson.loads(raw)  # schema-constrained replies are bare JSON
+    except orjson.JSONDecodeError:
+        parsed = None
+    if not isinstance(parsed, list):
+        # Prose or an object around the array: decode the first complete value
+        # after the first "[" in place, without slicing, ignoring anything after it.
+        parsed = None
+        start = raw.find("[")
+        if start >= 0:
+            try:
+                parsed, _ = _JSON_DECODER.raw_decode(raw, start)
+            except ValueError:
+                pass
+    if isinstance(parsed, list):
+        new_items = [name.lower() for item in parsed if (name := str(item).strip())]
+    if not new_items:
+        # Strip JSON array syntax before splitting
+        cleaned = raw.strip().lstrip("[").rstrip("]")
+        new_items = [
+            item.strip().strip("\"'").lower()
+            for item in cleaned.split(",")
+            if item.strip().strip("\"'")
+        ]
+    return new_items
+
+# Scans run on a worker thread so the page stays interactive during the
+# multi-second vision call; a fragment polls the job every SCAN_POLL_SECONDS.
+SCAN_POLL_SECONDS = 0.5
+
+@st.cache_resource
+def _scan_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="scan")
+
+# Cap on remembered scans; the oldest results are evicted first. Eviction
+# only costs a repeat vision call on re-upload: in-flight jobs are polled
+# through their futures, never through this cache.
+SCAN_CACHE_SIZE = 256
+
+@st.cache_resource
+def _scan_results() -> OrderedDict:
+    """Parsed scan results keyed by image hash, shared across sessions.
+
+    A re-upload of the same photo (same hash) skips the vision call. This
+    is a cache only; a session's own scan outcome comes from its future.
+    """
+    return OrderedDict()
+
+# Grammar-constrained decoding: Ollama can only emit a JSON array of strings.
+SCAN_SCHEMA = {"type": "array", "items": {"type": "string"}}
+
+def scan_ingredients(img_hash: str, scan_bytes: bytes, results: OrderedDict) -> list[str]:
+    """Detect food items in an image, caching them in results[img_hash].
+
+    Runs on the scan executor, so it must not call any st.* API.
+    """
+    raw = generate_with_image(SCAN_PROMPT, scan_bytes, response_format=SCAN_SCHEMA)
+    items = parse_scan_items(raw)
+    results[img_hash] = items
+    while len(results) > SCAN_CACHE_SIZE:
+        results.popitem(last=False)
+    return items
+
+def read_upload(file) -> tuple[bytes, str]:
+    """Return (scan_bytes, digest) for an upload, reused across reruns.
+
+    scan_bytes is the downsampled JPEG that is both previewed and sent to
+    the vision model, and digest is its hash. The result is cached in
+    session state under the upload's file_id, so unrelated reruns neither
+    re-read the UploadedFile buffer nor re-decode and re-hash the image;
+    the full-size upload is not kept around.
+    """
+    cached = st.session_state.image_cache
+    if cached is not None and cached["file_id"] == file.file_id:
+        return cached["scan_bytes"], cached["hash"]
+    # UploadedFile is already a seekable buffer; let Pillow read it directly
+    # instead of copying it into a bytes object first.
+    scan_bytes = downsample_for_scan(file)
+    digest = hashlib.blake2b(scan_bytes, digest_size=16).hexdigest()
+    st.session_state.image_cache = {
+        "file_id": file.file_id,
+        "scan_bytes": scan_bytes,
+        "hash": digest,
+    }
+    return scan_bytes, digest
+
+def _queue_for_review(img_hash: str, detected: list[str]):
+    """Append newly detected items to the pending review and mark the scan done."""
+    existing = st.session_state.pending_scan or []
+    # parse_scan_items() already lowercases every item.
+    seen = set(existing)
+    additions = []
+    for item in detected:
+        if item not in seen:
+            seen.add(item)
+            additions.append(item)
+    st.session_state.pending_scan = existing + additions
+    st.session_state.last_scanned_hash = img_hash
+
+@st.fragment(run_every=SCAN_POLL_SECONDS)
+def _scan_status():
+    """Show the pending scan's progress; rerun the app once it has finished.
+
+    Only this fragment reruns while the vision call is in flight, so the
+    inventory, chat, and review widgets aren't rebuilt on every poll.
+    """
+    job = st.session_state.scan_job
+    if job is None:
+        return
+    if job["future"].done():
+        st.rerun(scope="app")
+    st.info(f"🔍 Scanning ingredients... {time.monotonic() - job['started']:.0f}s")
+# ──────────────────────────────────────────────────────────────────────────────
+
+# ── CHAT HELPERS ──────────────────────────────────────────────────────────────
+def _clear_chat():
+    st.session_state.chat_history = []
+
+# st.write_stream re-renders on every chunk; batch tokens so a response
+# is a few dozen UI updates instead of one per token.
+STREAM_FLUSH_CHARS = 16
+STREAM_FLUSH_SECONDS = 0.05
+
+def coalesce_tokens(tokens, min_chars: int = STREAM_FLUSH_CHARS,
+                    max_seconds: float = STREAM_FLUSH_SECONDS):
+    """Re-yield a token stream in chunks of >= min_chars or every max_seconds."""
+    buf = []
+    size = 0
+    last_flush = time.monotonic()
+    for token in tokens:
+        buf.append(token)
+        size += len(token)
+        now = time.monotonic()
+        if size >= min_chars or now - last_flush >= max_seconds:
+            yield "".join(buf)
+            buf.clear()
+            size = 0
+            last_flush = now
+    if buf:
+        yield "".join(buf)
+# ──────────────────────────────────────────────────────────────────────────────
+
 st.set_page_config(
     page_title="Fridge-to-Fork",
     page_icon="🍳",
@@ -70,15 +369,28 @@ st.set_page_config(
 )
 
 # ── SESSION STATE ─────────────────────────────────────────────────────────────
-if "chat_history" not in st.session_state:
-    st.session_state.chat_history = []
-if "pending_scan" not in st.session_state:
-    st.session_state.pending_scan = None
-if "last_scanned_hash" not in st.session_state:
-    st.session_state.last_scanned_hash = None
-# ── DIETARY RESTRICTIONS session state ────────────────────────────────────────
-if "dietary_restrictions" not in st.session_state:
-    st.session_state.dietary_restrictions = []
+for _key, _default in (
+    ("chat_history", []),
+    ("pending_scan", None),
+    ("last_scanned_hash", None),
+    ("image_cache", None),
+    ("scan_job", None),
+    ("inventory_dirty", False),
+    ("last_history_len", 0),
+    ("last_recipe_ings", None),
+    # ── DIETARY RESTRICTIONS session state ────────────────────────────────────
+    ("dietary_restrictions", []),
+):
+    st.session_state.setdefault(_key, _default)
+# ──────────────────────────────────────────────────────────────────────────────
+
+# ── INVENTORY FLUSH ───────────────────────────────────────────────────────────
+# Widget callbacks run before the script body, so every edit made by this
+# interaction is already staged; write them with a single atomic save.
+if st.session_state.inventory_dirty:
+    save_inventory(st.session_state.inventory)
+    st.session_state.inventory_dirty = False
+st.session_state.inventory = load_inventory()
 # ──────────────────────────────────────────────────────────────────────────────
 
 # ── HEADER ────────────────────────────────────────────────────────────────────
@@ -89,22 +401,27 @@ st.divider()
 # ── SECTION 1: INVENTORY ──────────────────────────────────────────────────────
 st.subheader("📦 My Fridge Inventory")
 
-inventory = load_inventory()
+inventory = st.session_state.inventory
 
 if not inventory:
     st.info("Your fridge is empty. Scan a photo below to add ingredients.")
 else:
-    for item in inventory:
-        col1, col2 = st.columns([6, 1])
-        col1.write(f"• {item}")
-        if col2.button("✕", key=f"remove_{item}"):
-            inventory.remove(item)
-            save_inventory(inventory)
-            st.rerun()
-
-    if st.button("🗑️ Clear All"):
-        save_inventory([])
-        st.rerun()
+    # One markdown block and one picker instead of a row of widgets per item.
+    st.markdown("\n".join(f"- {item}" for item in inventory))
+
+    # Inside a form, picking items doesn't rerun the script until submit.
+    with st.form("inventory_remove_form", border=False):
+        st.multiselect(
+            "Remove items",
+            options=inventory,
+            key="inventory_remove",
+            placeholder="Select items to remove",
+            label_visibility="collapsed",
+        )
+        st.form_submit_button(
+            "✕ Remove selected", on_click=_remove_selected_inventory,
+        )
+    st.button("🗑️ Clear All", on_click=_set_inventory, args=([],))
 
 st.divider()
 
@@ -115,13 +432,11 @@ if _shopping_list:
     for _item in _shopping_list:
         _c1, _c2 = st.columns([6, 1])
         _c1.write(f"• {_item}")
-        if _c2.button("✕", key=f"sl_remove_{_item}"):
-            _shopping_list.remove(_item)
-            save_shopping_list(_shopping_list)
-            st.rerun()
-    if st.button("🗑️ Clear Shopping List"):
-        save_shopping_list([])
-        st.rerun()
+        _c2.button(
+            "✕", key=f"sl_remove_{_item}",
+            on_click=_remove_shopping_item, args=(_item,),
+        )
+    st.button("🗑️ Clear Shopping List", on_click=save_shopping_list, args=([],))
     st.divider()
 # ──────────────────────────────────────────────────────────────────────────────
 
@@ -132,146 +447,113 @@ st.caption(
     "Here it's exposed so you can see the pipeline in action."
 )
 
-input_mode = st.radio(
-    "Input mode",
-    ["📁 Upload a photo", "📷 Use camera"],
-    horizontal=True,
-    label_visibility="collapsed",
-)
+# Widgets below the toggle aren't built at all while the scanner is hidden,
+# so chat-only reruns skip the uploader, camera, and preview entirely.
+# Open by default only for an empty fridge, where scanning is the next step.
+st.session_state.setdefault("scan_open", not inventory)
+scan_open = st.toggle("Show scanner", key="scan_open")
 
-image_bytes = None
-image = None
+scan_bytes = None
+img_hash = None
 
-if input_mode == "📁 Upload a photo":
-    uploaded_file = st.file_uploader(
-        "Upload a fridge photo",
-        type=["jpg", "jpeg", "png"],
+if scan_open:
+    input_mode = st.radio(
+        "Input mode",
+        ["📁 Upload a photo", "📷 Use camera"],
+        horizontal=True,
         label_visibility="collapsed",
     )
-    if uploaded_file is not None:
-        image_bytes = uploaded_file.read()
-        image = Image.open(io.BytesIO(image_bytes))
-
-elif input_mode == "📷 Use camera":
-    camera_file = st.camera_input("Point at your open fridge")
-    if camera_file is not None:
-        image_bytes = camera_file.read()
-        image = Image.open(io.BytesIO(image_bytes))
-
-if image is not None:
-    st.image(image, caption="Fridge scan", width='stretch')
-
-if image_bytes is not None:
-    img_hash = hashlib.md5(image_bytes).hexdigest()
-    if img_hash != st.session_state.last_scanned_hash:
-        with st.spinner("Scanning ingredients..."):
-            image_b64 = base64.b64encode(image_bytes).decode("utf-8")
-            prompt = (
-                "You are a food inventory scanner. Look at this fridge image carefully.\n\n"
-                "List only the food items you can clearly and confidently identify. "
-                "Be conservative — if you are not sure, leave it out.\n\n"
-                "Rules:\n"
-                "- Output ONLY a JSON array of strings, nothing else\n"
-                "- Each string is a single food item (e.g. \"apple\", \"milk\", \"eggs\")\n"
-                "- No adjectives, quantities, or descriptions\n"
-                "- No packaging, containers, or kitchen tools\n"
-                "- No items you are uncertain about\n\n"
-                "Example: [\"apple\", \"milk\", \"eggs\", \"cheddar cheese\"]\n\n"
-                "JSON array:"
-            )
-            try:
-                raw = generate_with_image(prompt, image_b64)
-                # Try JSON parsing first, fall back to comma-split
-                new_items = []
-                match = re.search(r'\[.*\]', raw, re.DOTALL)
-                if match:
-                    try:
-                        parsed = json.loads(match.group())
-                        new_items = [
-                            str(item).strip().lower()
-                            for item in parsed
-                            if str(item).strip()
-                        ]
-                    except json.JSONDecodeError:
-                        pass
-                if not new_items:
-                    # Strip JSON array syntax before splitting
-                    cleaned = raw.strip().lstrip("[").rstrip("]")
-                    new_items = [
-                        item.strip().strip("\"'").lower()
-                        for item in cleaned.split(",")
-                        if item.strip().strip("\"'")
-                    ]
-                existing = st.session_state.pending_scan or []
-                seen = {i.lower() for i in existing}
-                for item in new_items:
-                    if item.lower() not in seen:
-                        existing.append(item)
-                        seen.add(item.lower())
-                st.session_state.pending_scan = existing
-                st.session_state.last_scanned_hash = img_hash
-            except Exception as e:
-                st.error(f"Scan failed: {e}")
-                st.stop()
+
+    if input_mode == "📁 Upload a photo":
+        uploaded_file = st.file_uploader(
+            "Upload a fridge photo",
+            type=["jpg", "jpeg", "png"],
+            label_visibility="collapsed",
+        )
+        if uploaded_file is not None:
+            scan_bytes, img_hash = read_upload(uploaded_file)
+
+    elif input_mode == "📷 Use camera":
+        camera_file = st.camera_input("Point at your open fridge")
+        if camera_file is not None:
+            scan_bytes, img_hash = read_upload(camera_file)
+
+    if scan_bytes is not None:
+        # The downsampled JPEG is plenty for a preview and a fraction of the
+        # upload's size over the websocket.
+        st.image(scan_bytes, caption="Fridge scan", width='stretch')
+
+_job = st.session_state.scan_job
+if (
+    scan_bytes is not None
+    and img_hash is not None
+    and img_hash != st.session_state.last_scanned_hash
+    and (_job is None or _job["hash"] != img_hash)
+):
+    # A new image: reuse a cached result, or start scanning it.
+    _results = _scan_results()
+    if (_detected := _results.get(img_hash)) is not None:
+        st.session_state.scan_job = _job = None
+        _queue_for_review(img_hash, _detected)
+    else:
+        _job = {
+            "hash": img_hash,
+            "future": _scan_executor().submit(
+                scan_ingredients, img_hash, scan_bytes, _results
+            ),
+            "started": time.monotonic(),
+        }
+        st.session_state.scan_job = _job
+
+# Polled whether or not the scanner is shown, so hiding it mid-scan still
+# lands the result in the review below.
+if _job is not None:
+    if _job["future"].done():
+        # The future is the source of truth; _results is only a cache that
+        # other sessions may have evicted this hash from in the meantime.
+        st.session_state.scan_job = None
+        if (_error := _job["future"].exception()) is not None:
+            st.error(f"Scan failed: {_error}")
+            st.stop()
+        _queue_for_review(_job["hash"], _job["future"].result())
+    else:
+        _scan_status()
 
 if st.session_state.pending_scan is not None:
     st.markdown("**Review detected ingredients — uncheck anything wrong:**")
-    checked = {
-        item: st.checkbox(item, value=True, key=f"scan_{item}")
-        for item in st.session_state.pending_scan
-    }
-    confirmed = [item for item, selected in checked.items() if selected]
-
-    if st.button("✅ Add to Inventory", type="primary", disabled=not confirmed):
-        existing = load_inventory()
-        merged = merge_ingredients(existing, confirmed)
-        save_inventory(merged)
-        st.session_state.pending_scan = None
-        st.success(f"✅ {len(confirmed)} ingredients added. Inventory now has {len(merged)} items.")
-        st.rerun()
+    _items = st.session_state.pending_scan
+    edited = st.data_editor(
+        pd.DataFrame({"keep": [True] * len(_items), "item": _items}),
+        width="stretch",
+        hide_index=True,
+        disabled=["item"],
+        key="scan_review",
+    )
+    confirmed = edited.loc[edited["keep"], "item"].tolist()
+
+    # Callbacks run before the next script pass, so the page renders the
+    # updated state without a second, explicit st.rerun().
+    st.button(
+        "✅ Add to Inventory", type="primary", disabled=not confirmed,
+        on_click=_add_to_inventory,
+    )
 
 st.divider()
 
 # ── SECTION 3: CHAT ───────────────────────────────────────────────────────────
 st.subheader("💬 What Can I Cook?")
 
-current_inventory = load_inventory()
-
-
-# def build_chat_prompt(user_message: str, inventory: list[str], history: list[dict]) -> str:
-#     inv = "\n".join(f"- {x}" for x in inventory)
-#
-#     recent = history[-6:]
-#     history_txt = "\n".join(f"{m['role'].upper()}: {m['content']}" for m in recent)
-#
-#     return f"""You are an AI chef assistant.
-#
-# Rules:
-# - Prioritize using the inventory items as primary ingredients.
-# - You may add at most 3 pantry staples from: salt, pepper, oil, water, sugar, soy sauce, butter, garlic, onion.
-# - If the user asks "what can I cook", propose 2 options max, each with short steps.
-# - If the user asks for one recipe, return one detailed recipe with steps.
-# - No unnecessary commentary.
-#
-# Current inventory:
-# {inv}
-#
-# Conversation so far:
-# {history_txt}
-#
-# USER: {user_message}
-# ASSISTANT:
-# """
-
+current_inventory = inventory
 
 if not current_inventory:
     st.warning("Scan some ingredients first — then ask me what to cook.")
 else:
     col1, col2 = st.columns([8, 1])
     col1.caption(f"Llama 3 knows you have {len(current_inventory)} ingredients. Just ask naturally.")
-    if col2.button("🗑️", help="Clear chat", disabled=not st.session_state.chat_history):
-        st.session_state.chat_history = []
-        st.rerun()
+    col2.button(
+        "🗑️", help="Clear chat", disabled=not st.session_state.chat_history,
+        on_click=_clear_chat,
+    )
 
     # ── DIETARY RESTRICTIONS: multiselect above chat ──────────────────────────
     st.multiselect(
@@ -288,22 +570,28 @@ else:
             st.markdown(message["content"])
 
     # ── SHOPPING LIST: button appears after any recipe response ───────────────
-    _last_asst = next(
-        (m for m in reversed(st.session_state.chat_history) if m["role"] == "assistant"),
-        None,
-    )
-    if _last_asst and "### Ingredients" in _last_asst["content"]:
-        _recipe_ings = extract_recipe_ingredients(_last_asst["content"])
+    # Re-parse the latest recipe only when the chat history has changed.
+    if len(st.session_state.chat_history) != st.session_state.last_history_len:
+        _last_asst = next(
+            (m for m in reversed(st.session_state.chat_history) if m["role"] == "assistant"),
+            None,
+        )
+        st.session_state.last_recipe_ings = (
+            extract_recipe_ingredients(_last_asst["content"])
+            if _last_asst and "### Ingredients" in _last_asst["content"]
+            else None
+        )
+        st.session_state.last_history_len = len(st.session_state.chat_history)
+    _recipe_ings = st.session_state.last_recipe_ings
+    if _recipe_ings is not None:
         _missing = get_missing_ingredients(_recipe_ings, current_inventory)
         if _missing:
             _b1, _b2 = st.columns([3, 1])
             _b1.markdown("**Missing:** " + ", ".join(f"`{i}`" for i in _missing))
-            if _b2.button("🛒 Add to shopping list", type="primary"):
-                _existing_sl = load_shopping_list()
-                _merged_sl = sorted(set(_existing_sl) | set(_missing))
-                save_shopping_list(_merged_sl)
-                st.success(f"✅ Added {len(_missing)} item(s) to your shopping list.")
-                st.rerun()
+            _b2.button(
+                "🛒 Add to shopping list", type="primary",
+                on_click=_add_to_shopping_list, args=(_missing,),
+            )
         else:
             st.caption("✅ You have everything for this recipe.")
     # ─────────────────────────────────────────────────────────────────────────
@@ -317,12 +605,12 @@ else:
 
         with st.chat_message("assistant"):
             assistant_response = st.write_stream(
-                stream_chef_response(
+                coalesce_tokens(stream_chef_response(
                     user_message=user_input,
                     inventory=current_inventory,
                     history=st.session_state.chat_history[:-1],
                     dietary_restrictions=st.session_state.dietary_restrictions or None,
-                )
+                ))
             )
 
         st.session_state.chat_history.append({"role": "assistant", "content": assistant_response})
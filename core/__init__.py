@@ -4,6 +4,16 @@ This package contains the core business logic for generating recipes
 from ingredient lists.
 """
 
-from core.recipe import ingredients_to_recipe
+from core.recipe import (
+    ingredients_to_recipe,
+    ingredients_to_recipe_async,
+    ingredients_to_recipe_stream,
+    ingredients_to_recipes_batch,
+)
 
-__all__ = ["ingredients_to_recipe"]
+__all__ = [
+    "ingredients_to_recipe",
+    "ingredients_to_recipe_async",
+    "ingredients_to_recipe_stream",
+    "ingredients_to_recipes_batch",
+]
@@ -4,18 +4,27 @@ This module handles the conversion of ingredient lists to recipe
 suggestions using the Ollama text generation API.
 """
 
-from typing import Optional
+import asyncio
+import os
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from typing import Iterator, Optional, Sequence
+
+import orjson
 from utils.ollama_client import generate_text as chat_text_only
-from utils.ollama_client import generate_chat_stream
+from utils.ollama_client import generate_chat_stream, generate_text_stream
+from utils.ollama_client import NUM_PARALLEL
 
 import re
 
 # System prompt template — inventory injected at call time, no history/user message here.
+# Static instructions come first and the per-user inventory last, so the long
+# shared prefix stays byte-identical across users and Ollama can reuse its KV
+# cache for it.
 CHEF_SYSTEM_PROMPT = """You are an experienced home chef who thinks practically and creatively.
 
-You have access to the following current ingredients:
-{inv}
-
 You can:
 - Create recipes (simple or detailed)
 - Suggest substitutions
@@ -39,7 +48,34 @@ If giving a full recipe, use exactly these headers:
 - item
 ### Steps
 1. step
-For all other responses — suggestions, follow-ups, substitutions — respond naturally without any headers."""
+For all other responses — suggestions, follow-ups, substitutions — respond naturally without any headers.
+
+You have access to the following current ingredients:
+{inv}"""
+
+# The template has a single {inv} slot; split it once so rendering is two
+# concatenations instead of a str.format parse on every call.
+_CHEF_PREFIX, _CHEF_SUFFIX = CHEF_SYSTEM_PROMPT.split("{inv}")
+
+
+# Rough prompt-token budget for replayed chat turns (not counting the system prompt).
+HISTORY_TOKEN_BUDGET = 1500
+
+
+def _fit_history(history: list[dict], budget: int = HISTORY_TOKEN_BUDGET) -> list[dict]:
+    """Return the longest suffix of history that fits in budget tokens.
+
+    Tokens are estimated as 1.3 per whitespace-separated word, which is close
+    enough for English chat without pulling in a tokenizer.
+    """
+    used = 0.0
+    start = len(history)
+    while start > 0:
+        used += len(history[start - 1]["content"].split()) * 1.3
+        if used > budget:
+            break
+        start -= 1
+    return history[start:]
 
 
 def _build_messages(
@@ -47,28 +83,25 @@ def _build_messages(
     inventory: list[str],
     history: list[dict],
     dietary_restrictions: list[str] | None = None,
+    history_budget: int = HISTORY_TOKEN_BUDGET,
 ) -> list[dict]:
     """Build a properly role-separated message list for /api/chat.
 
     Returns a list with:
       - one system message (chef persona + inventory, + dietary restrictions if any)
-      - up to 6 prior turns from history as user/assistant messages
+      - the most recent prior turns that fit in history_budget tokens
       - the current user message
     """
-    inv = _format_list(inventory)
-    system_content = CHEF_SYSTEM_PROMPT.format(inv=inv)
-    # ── DIETARY RESTRICTIONS: injected into system message ────────────────────
-    if dietary_restrictions:
-        system_content += (
-            f"\n\nDietary restrictions (STRICT — never suggest or include these in any recipe): "
-            + ", ".join(dietary_restrictions)
-        )
-    # ─────────────────────────────────────────────────────────────────────────
-    messages = [{"role": "system", "content": system_content}]
-    for m in history[-6:]:
-        messages.append({"role": m["role"], "content": m["content"]})
-    messages.append({"role": "user", "content": user_message})
-    return messages
+    # Sorted so the same pantry/restrictions picked in any order render one
+    # byte-identical system prompt (one cache entry, one reusable KV prefix).
+    system_content = _system_prompt_for(
+        tuple(sorted(inventory)), tuple(sorted(dietary_restrictions or ()))
+    )
+    return [
+        {"role": "system", "content": system_content},
+        *({"role": m["role"], "content": m["content"]} for m in _fit_history(history, history_budget)),
+        {"role": "user", "content": user_message},
+    ]
 
 
 def stream_chef_response(
@@ -96,18 +129,107 @@ def stream_chef_response(
     return generate_chat_stream(messages)
 
 
+# One semaphore per event loop: asyncio primitives bind to the loop that
+# first waits on them, and callers may use a fresh loop per asyncio.run().
+_LOOP_SEMAPHORES: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def _llm_semaphore() -> asyncio.Semaphore:
+    """Return this loop's semaphore capping in-flight calls at NUM_PARALLEL."""
+    loop = asyncio.get_running_loop()
+    sem = _LOOP_SEMAPHORES.get(loop)
+    if sem is None:
+        sem = _LOOP_SEMAPHORES[loop] = asyncio.Semaphore(NUM_PARALLEL)
+    return sem
+
+
+async def stream_chef_response_async(
+    user_message: str,
+    inventory: list[str],
+    history: list[dict],
+    dietary_restrictions: list[str] | None = None,
+):
+    """Async-generator version of stream_chef_response.
+
+    The blocking HTTP stream is advanced in a worker thread so several chats
+    can run under one event loop, at most NUM_PARALLEL at a time.
+    """
+    async with _llm_semaphore():
+        tokens = stream_chef_response(user_message, inventory, history, dietary_restrictions)
+        done = object()
+        while (token := await asyncio.to_thread(next, tokens, done)) is not done:
+            yield token
+
+
+# Bullet/numbering characters plus whitespace, stripped from the front.
+_LEAD_CHARS = "-*•0123456789.) \t\r\n\f\v\xa0"
+_RE_LEAD = re.compile(r"^[-*•\d\.\)\s]+")
+
+
+@lru_cache(maxsize=4096)
 def _normalize_ingredient(s: str) -> str:
-    """Light normalization to stabilize prompts."""
-    s = s.strip().lower()
-    s = re.sub(r"^[-*•\d\.\)\s]+", "", s).strip()
-    s = re.sub(r"\s+", " ", s)
-    return s
+    """Light normalization to stabilize prompts.
+
+    Memoized per process (bounded at 4096 entries): inventories repeat
+    across turns, so most calls are dict lookups.
+    """
+    s = s.strip().lower().lstrip(_LEAD_CHARS)
+    if s[:1].isspace() or s[:1].isdecimal():
+        # A non-ASCII space or digit stopped the fast strip; finish with the
+        # Unicode-aware regex (\s is str.isspace(), \d is str.isdecimal()).
+        s = _RE_LEAD.sub("", s)
+    return " ".join(s.split())
 
-def _format_list(items: list[str]) -> str:
-    return "\n".join(f"- {x}" for x in items)
+def _format_list(items: Sequence[str]) -> str:
+    # One join instead of an f-string per item.
+    return "- " + "\n- ".join(items) if items else ""
+
+
+@lru_cache(maxsize=64)
+def _system_prompt_for(inv_key: tuple[str, ...], diet_key: tuple[str, ...]) -> str:
+    """Render the chef system prompt for an inventory + restrictions pair.
+
+    Memoized because both rarely change between turns, and returning the
+    same string each turn keeps the prompt prefix byte-identical for
+    Ollama's KV-cache reuse.
+    """
+    parts = [_CHEF_PREFIX, _format_list(inv_key), _CHEF_SUFFIX]
+    # ── DIETARY RESTRICTIONS: injected into system message ────────────────────
+    if diet_key:
+        parts.append(
+            "\n\nDietary restrictions (STRICT — never suggest or include these in any recipe): "
+        )
+        parts.append(", ".join(diet_key))
+    # ─────────────────────────────────────────────────────────────────────────
+    return "".join(parts)
 
 
 # ── SHOPPING LIST: extract ingredient names from a recipe ─────────────────────
+_RE_ING_SECTION = re.compile(r'### Ingredients\s*\n(.*?)(?=###|\Z)', re.DOTALL)
+# The section body is cleaned block-wide with MULTILINE patterns instead of
+# three subs per line. Every str.splitlines() boundary is first folded to
+# "\n", and the classes use [^\S\n] (any whitespace but a newline), so the
+# passes see the same lines and whitespace as the per-line version did.
+# Bullets and a leading quantity come off first; units are then dropped
+# anywhere they're followed by more text; the line pattern captures the name
+# up to a trailing qualifier like ", to taste", "(optional)", "as needed".
+_RE_BREAKS = re.compile(r'\r\n?|[\x0b\x0c\x1c-\x1e\x85\u2028\u2029]')
+_RE_HEAD = re.compile(r'^[^\S\n]*[-•* \t]*(?:\d[\d/\-\.]*[^\S\n]*)?', re.MULTILINE)
+_RE_UNIT = re.compile(
+    r'\b(?:cups?|tablespoons?|tbsps?|teaspoons?|tsps?|grams?|g|kg|ml'
+    r'|oz|lbs?|cloves?|slices?|pieces?|pinch|handful|bunch)[^\S\n]+(?=\S)'
+    r'(?:of[^\S\n]+(?=\S))?',
+    re.IGNORECASE,
+)
+_RE_LINE = re.compile(
+    r'^(?P<name>.*?)'
+    r'(?:,?[^\S\n]*(?:to taste|optional|as needed|to serve|for serving|for garnish).*)?$',
+    re.MULTILINE | re.IGNORECASE,
+)
+
+
 def extract_recipe_ingredients(text: str) -> list[str]:
     """Parse the ### Ingredients section of a recipe and return clean names.
 
@@ -116,46 +238,29 @@ def extract_recipe_ingredients(text: str) -> list[str]:
 
     Used by the shopping list feature in client.py — safe to remove.
     """
-    match = re.search(r'### Ingredients\s*\n(.*?)(?=###|\Z)', text, re.DOTALL)
+    match = _RE_ING_SECTION.search(text)
     if not match:
         return []
-    ingredients = []
-    for line in match.group(1).strip().splitlines():
-        line = line.strip().lstrip('-•* \t')
-        if not line:
-            continue
-        line = re.sub(r'^\d[\d/\-\.]*\s*', '', line)  # strip leading quantity
-        line = re.sub(
-            r'\b(cups?|tablespoons?|tbsps?|teaspoons?|tsps?|grams?|g|kg|ml'
-            r'|oz|lbs?|cloves?|slices?|pieces?|pinch|handful|bunch)\s+(of\s+)?',
-            '', line, flags=re.IGNORECASE,
-        )
-        # strip qualifiers like ", to taste", "(optional)", "as needed"
-        line = re.sub(
-            r',?\s*(to taste|optional|as needed|to serve|for serving|for garnish).*$',
-            '', line, flags=re.IGNORECASE,
-        )
-        line = line.strip().lower()
-        if line:
-            ingredients.append(line)
-    return ingredients
+    block = _RE_BREAKS.sub('\n', match.group(1))
+    block = _RE_UNIT.sub('', _RE_HEAD.sub('', block))
+    return [
+        name for m in _RE_LINE.finditer(block)
+        if (name := m.group('name').strip().lower())
+    ]
 # ──────────────────────────────────────────────────────────────────────────────
 
 
 # simple check for basic recipe structure; we can add more complex validation later
-def _looks_valid(text: str) -> bool:
-    if not text:
-        return False
+_REQUIRED = ("recipe name:", "ingredients used:", "steps:")
+# Anchored lookaheads: one case-insensitive match call, no lowercased copy.
+_RE_REQUIRED = re.compile(
+    "".join(f"(?=.*{re.escape(section)})" for section in _REQUIRED),
+    re.IGNORECASE | re.DOTALL,
+)
 
-    t = text.lower()
-
-    required_sections = [
-        "recipe name:",
-        "ingredients used:",
-        "steps:"
-    ]
 
-    return all(section in t for section in required_sections)
+def _looks_valid(text: str) -> bool:
+    return bool(text) and _RE_REQUIRED.match(text) is not None
 
 
 
@@ -178,7 +283,8 @@ def ingredients_to_recipe(
 
     Returns:
         Full recipe text including title, ingredients, and instructions.
-        Empty string if generation fails.
+        Empty string if generation fails. Successful results are cached per
+        (ingredients, restrictions, cuisine) set, in any order.
 
     Raises:
         ValueError: If ingredients list is empty.
@@ -192,7 +298,6 @@ def ingredients_to_recipe(
         - Add cuisine type preferences
         - Support recipe customization (spice level, cooking method)
         - Add ingredient substitution suggestions
-        - Cache recipes for same ingredient combinations
         - Add recipe validation (ensure all ingredients are used)
         - Support recipe scaling (servings adjustment)
         - Add nutritional information generation
@@ -200,61 +305,193 @@ def ingredients_to_recipe(
         - Add cooking tips and variations
         - Support multi-step recipe generation with user feedback
     """
+    return _recipe_for_key(_recipe_key(ingredients, dietary_restrictions, cuisine_type))
+
+
+def _recipe_for_key(key: tuple[tuple[str, ...], tuple[str, ...], str]) -> str:
+    """ingredients_to_recipe for an already validated _recipe_key() result."""
+    canned = _canned_recipe(*key)
+    if canned:
+        return canned
+
+    # 3) Call the model (or reuse a recipe for the same canonical inputs)
+    try:
+        return _generate_recipe_cached(*key)
+    except _EmptyRecipe:
+        return ""  # an empty reply is a result, not an error; just not cached
+    except Exception as e:
+        print(f"Error generating recipe: {e}")
+        return ""
+
+
+def ingredients_to_recipe_stream(
+    ingredients: list[str],
+    dietary_restrictions: Optional[list[str]] = None,
+    cuisine_type: Optional[str] = None,
+) -> Iterator[str]:
+    """Stream a recipe token by token; same prompt as ingredients_to_recipe.
+
+    Use with st.write_stream() so the first tokens render while the rest is
+    still generating. Streamed output bypasses the recipe cache.
+
+    Raises:
+        ValueError: If ingredients list is empty, when called.
+        Exception: "Text stream API failed: ..." from the client, while
+            iterating.
+    """
+    # Not a generator itself, so bad input raises here rather than on next().
+    key = _recipe_key(ingredients, dietary_restrictions, cuisine_type)
+    canned = _canned_recipe(*key)
+    if canned:
+        return iter((canned,))
+    return generate_text_stream(_recipe_prompt(*key))
+
+
+# Set CANNED_RECIPES=0 to always ask the model (e.g. to compare outputs).
+USE_CANNED_RECIPES: bool = os.getenv("CANNED_RECIPES", "1") != "0"
+CANNED_RECIPES_FILE = Path(__file__).with_name("canned_recipes.json")
+
+
+@lru_cache(maxsize=1)
+def _canned_table() -> dict[frozenset[str], str]:
+    """Load the curated ingredient-set → recipe table on first use."""
+    try:
+        entries = orjson.loads(CANNED_RECIPES_FILE.read_bytes())
+    except (OSError, orjson.JSONDecodeError):
+        return {}
+    return {frozenset(e["ingredients"]): e["recipe"] for e in entries}
+
+
+def _canned_recipe(ing_key: tuple[str, ...], diet_key: tuple[str, ...], cuisine: str) -> str:
+    """Return a curated recipe for an exact ingredient match, else "".
+
+    Only used without restrictions or cuisine, which canned text can't honor.
+    """
+    if not USE_CANNED_RECIPES or diet_key or cuisine:
+        return ""
+    return _canned_table().get(frozenset(ing_key), "")
+
+
+def _recipe_key(
+    ingredients: list[str],
+    dietary_restrictions: Optional[list[str]],
+    cuisine_type: Optional[str],
+) -> tuple[tuple[str, ...], tuple[str, ...], str]:
+    """Validate and normalize recipe inputs into a canonical, hashable key.
+
+    Ingredients and restrictions come back as sorted tuples so the same set
+    in any order maps to one prompt and one cache entry.
+    """
     # Input validation
     if not ingredients:
         raise ValueError("Ingredients list cannot be empty")
 
-    normed: list[str] = []
-    seen = set()
-    for ing in ingredients:
-        n = _normalize_ingredient(ing)
-        if not n:
-            continue
-        if n not in seen:
-            seen.add(n)
-            normed.append(n)
-    
+    normed = list(dict.fromkeys(n for ing in ingredients if (n := _normalize_ingredient(ing))))
+
     if not normed:
         raise ValueError("No valid ingredients after normalization; check input formatting")
-    # Normalize ingredients before generating recipe
-    ingredient_list = _format_list(normed)
-
     # 2) Normalize optional controls
 
-    restrictions = dietary_restrictions or []
-    restrictions = [_normalize_ingredient(r) for r in restrictions if _normalize_ingredient(r)]
-    restrictions_str = ", ".join(restrictions) if restrictions else "None"
+    restrictions = [n for r in dietary_restrictions or () if (n := _normalize_ingredient(r))]
 
     cuisine = (cuisine_type or "").strip()
+
+    return tuple(sorted(normed)), tuple(sorted(restrictions)), cuisine
+
+
+# Tail of the recipe prompt when no restrictions or cuisine are given, the
+# common case; precomputed so that path is a plain concatenation.
+_DEFAULT_RECIPE_SUFFIX = (
+    "\n\nDietary restrictions: None"
+    "\nCuisine preference: Any"
+    "\n\nSuggest one recipe using these ingredients."
+)
+
+
+def _recipe_prompt(ing_key: tuple[str, ...], diet_key: tuple[str, ...], cuisine: str) -> str:
+    """Render the one-shot recipe prompt for a _recipe_key() result."""
+    # Normalize ingredients before generating recipe
+    ingredient_list = _format_list(ing_key)
+    if not diet_key and not cuisine:
+        return _CHEF_PREFIX + ingredient_list + _CHEF_SUFFIX + _DEFAULT_RECIPE_SUFFIX
+    restrictions_str = ", ".join(diet_key) if diet_key else "None"
     cuisine_str = cuisine if cuisine else "Any"
 
+    return "".join((
+        _CHEF_PREFIX, ingredient_list, _CHEF_SUFFIX,
+        "\n\nDietary restrictions: ", restrictions_str,
+        "\nCuisine preference: ", cuisine_str,
+        "\n\nSuggest one recipe using these ingredients.",
+    ))
 
 
-    # prompt = RECIPE_PROMPT_TEMPLATE.format(ingredients=ingredient_list,
-    #                                        dietary_restrictions=restrictions_str,
-    #                                        cuisine_type=cuisine_str)
-    prompt = CHEF_SYSTEM_PROMPT.format(inv=ingredient_list) + (
-        f"\n\nDietary restrictions: {restrictions_str}"
-        f"\nCuisine preference: {cuisine_str}"
-        f"\n\nSuggest one recipe using these ingredients."
-    )
-    
+class _EmptyRecipe(Exception):
+    """The model replied with nothing; raised so lru_cache keeps no entry."""
 
-    # 3) Call the model to generate a recipe
-    try:
-        recipe = chat_text_only(prompt)
-    except Exception as e:
-        print(f"Error generating recipe: {e}")
-        return ""
 
+@lru_cache(maxsize=512)
+def _generate_recipe_cached(
+    ing_key: tuple[str, ...],
+    diet_key: tuple[str, ...],
+    cuisine: str,
+) -> str:
+    """Call the model for a _recipe_key() result, memoized per input set.
+
+    Raises on API errors, and _EmptyRecipe on an empty reply, so that
+    neither is cached; ingredients_to_recipe() still returns "" for both.
+    """
     # Parse and validate recipe structure
-    recipe = (recipe or "").strip()
+    recipe = (chat_text_only(_recipe_prompt(ing_key, diet_key, cuisine)) or "").strip()
     if not recipe:
-        return ""
+        raise _EmptyRecipe
+    return recipe
+
+
+async def ingredients_to_recipe_async(
+    ingredients: list[str],
+    dietary_restrictions: Optional[list[str]] = None,
+    cuisine_type: Optional[str] = None,
+) -> str:
+    """Awaitable ingredients_to_recipe for use with asyncio.gather.
+
+    Runs the blocking call in a worker thread, gated so that no more than
+    NUM_PARALLEL requests reach the server at once.
+    """
+    async with _llm_semaphore():
+        return await asyncio.to_thread(
+            ingredients_to_recipe, ingredients, dietary_restrictions, cuisine_type
+        )
+
 
+def ingredients_to_recipes_batch(
+    jobs: list[tuple[list[str], Optional[list[str]], Optional[str]]],
+) -> list[str]:
+    """Generate several recipes concurrently.
 
+    Ollama's /api/generate takes a single prompt, so the jobs are fanned out
+    over at most NUM_PARALLEL worker threads sharing the client's keep-alive
+    session; total latency is close to the slowest job instead of the sum.
+    Jobs with the same _recipe_key() share one call.
 
-    return recipe   
+    Args:
+        jobs: (ingredients, dietary_restrictions, cuisine_type) tuples, the
+            same arguments ingredients_to_recipe takes.
+
+    Returns:
+        Recipe texts in the same order as jobs ("" for a failed job).
+
+    Raises:
+        ValueError: If any job has an empty ingredients list.
+    """
+    if not jobs:
+        return []
+    # The recipe cache only fills once a call returns, so duplicates running
+    # side by side would each reach the model; dedupe them up front.
+    keys = [_recipe_key(*job) for job in jobs]
+    unique = list(dict.fromkeys(keys))
+    with ThreadPoolExecutor(max_workers=min(NUM_PARALLEL, len(unique))) as pool:
+        recipes = dict(zip(unique, pool.map(_recipe_for_key, unique)))
+    return [recipes[key] for key in keys]
 
 
 
@@ -10,14 +10,15 @@ Or from project root:
 
 import os
 import sys
+from pathlib import Path
 
-# Ensure project root is on path
-sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
 
-from dotenv import load_dotenv
-
-load_dotenv()
+# Ensure project root is on path (not needed under python -m scripts.test_ollama)
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
 
+# utils.ollama_client loads .env itself on import
 from utils.ollama_client import BASE_URL, generate_text, health_check
 
 
@@ -29,7 +30,7 @@ def main() -> None:
     print(f"  OLLAMA_PORT = {os.getenv('OLLAMA_PORT', '(not set, default 11434)')}")
     print()
 
-    if not os.path.exists(os.path.join(os.path.dirname(os.path.dirname(__file__)), ".env")):
+    if not (PROJECT_ROOT / ".env").exists():
         print("Warning: No .env file. Create one with: cp .env.example .env")
         print()
 
@@ -4,11 +4,21 @@ Loads GB10_IP, OLLAMA_PORT, MODEL from .env and provides health check,
 vision (image + prompt), and text-only generation against the Ollama API.
 """
 
-import json
+import base64
 import os
+import threading
+from typing import Iterator
 
+import orjson
 import requests
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:  # SIMD base64; optional, the stdlib encoder is the fallback
+    import pybase64
+except ImportError:
+    pybase64 = None
 
 load_dotenv()
 
@@ -17,62 +27,129 @@ GB10_IP: str = os.getenv("GB10_IP", "localhost")
 OLLAMA_PORT: str = os.getenv("OLLAMA_PORT", "11434")
 MODEL: str = os.getenv("MODEL", "llava:13b")
 CHAT_MODEL: str = os.getenv("CHAT_MODEL", "llama3:8b")
+# Match the server's OLLAMA_NUM_PARALLEL; more in-flight requests just queue.
+NUM_PARALLEL: int = max(1, int(os.getenv("OLLAMA_NUM_PARALLEL", "4")))
 
 BASE_URL: str = f"http://{GB10_IP}:{OLLAMA_PORT}"
 
+# One pooled session for the whole process: the module stays imported across
+# Streamlit reruns, so scan and chat calls reuse a warm keep-alive connection
+# instead of opening a new TCP connection per request.
+_SESSION = requests.Session()
+_SESSION.headers["Connection"] = "keep-alive"
+# pool_maxsize bounds concurrent connections to the one Ollama host; keep it
+# above NUM_PARALLEL so batch/async fan-out never waits on the pool.
+_adapter = HTTPAdapter(
+    pool_connections=16, pool_maxsize=max(32, NUM_PARALLEL), max_retries=0
+)
+_SESSION.mount("http://", _adapter)
+_SESSION.mount("https://", _adapter)
+# Model calls retry transient failures (connection drops, 502/503/504 while
+# Ollama loads a model) with exponential backoff. Mounted on the /api/ prefix
+# only, so health_check still fails fast when the server is down.
+_api_adapter = HTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=max(32, NUM_PARALLEL),
+    max_retries=Retry(
+        total=3,
+        read=0,  # a read timeout means a slow generation; don't resend it
+        backoff_factor=0.5,
+        status_forcelist=[502, 503, 504],
+        allowed_methods=["POST"],
+        raise_on_status=False,
+    ),
+)
+_SESSION.mount(f"{BASE_URL}/api/", _api_adapter)
+
+# Process-wide cap on in-flight model calls, shared by every Streamlit
+# session, worker thread and event loop. A streamed call keeps its slot
+# until the stream is exhausted or closed.
+_CALL_SLOTS = threading.BoundedSemaphore(NUM_PARALLEL)
+
+
+def _post_json(path: str, payload: dict, **kwargs) -> requests.Response:
+    """POST payload to {BASE_URL}{path}, serialized with orjson.
+
+    Extra kwargs (timeout, stream) are passed through to the session.
+    """
+    return _SESSION.post(
+        f"{BASE_URL}{path}",
+        data=orjson.dumps(payload),
+        headers={"Content-Type": "application/json"},
+        **kwargs,
+    )
+
 
 def health_check() -> bool:
     """Check if the Ollama server is reachable.
 
-    Sends a GET request to BASE_URL with a 3-second timeout.
+    Sends a GET request to BASE_URL over the shared session with a 3-second timeout.
     Called by: app startup, UI status indicators, or tests.
 
     Returns:
         True if the server responds with status_code 200, False on any exception.
     """
     try:
-        resp = requests.get(BASE_URL, timeout=3)
+        resp = _SESSION.get(BASE_URL, timeout=3)
         return resp.status_code == 200
     except Exception:
         return False
 
 
-def generate_with_image(prompt: str, image_base64: str) -> str:
-    """Generate a response from the vision model given a prompt and a base64 image.
+def encode_image(image: bytes) -> str:
+    """Base64-encode raw image bytes for the Ollama "images" field.
+
+    Uses pybase64's SIMD encoder when installed. Base64 output is pure
+    ASCII, so the stdlib fallback decodes with the ASCII fast path.
+    """
+    if pybase64 is not None:
+        return str(pybase64.b64encode_as_string(image))
+    return base64.b64encode(image).decode("ascii")
+
 
-    POSTs to {BASE_URL}/api/generate with model, prompt, images=[image_base64],
+def generate_with_image(
+    prompt: str, image: bytes | str, response_format: str | dict | None = None
+) -> str:
+    """Generate a response from the vision model given a prompt and an image.
+
+    POSTs to {BASE_URL}/api/generate with model, prompt, images=[image],
     and stream=False. Called by: core/vision or app when detecting ingredients from a photo.
 
     Args:
         prompt: Text prompt for the vision model.
-        image_base64: Base64-encoded image string.
+        image: Raw image bytes (encoded here, once) or an already
+            base64-encoded string.
+        response_format: Optional Ollama "format": "json" or a JSON schema,
+            to constrain decoding to valid JSON.
 
     Returns:
-        The model response text from resp.json()["response"].
+        The "response" field of the JSON body.
 
     Raises:
         Exception: With message "Vision API failed: {e}" on any request or parse error.
     """
+    if isinstance(image, bytes):
+        image = encode_image(image)
+    payload = {
+        "model": MODEL,
+        "prompt": prompt,
+        "images": [image],
+        "stream": False,
+        "keep_alive": -1,
+        "options": {"temperature": 0},
+    }
+    if response_format is not None:
+        payload["format"] = response_format
     try:
-        resp = requests.post(
-            f"{BASE_URL}/api/generate",
-            json={
-                "model": MODEL,
-                "prompt": prompt,
-                "images": [image_base64],
-                "stream": False,
-                "keep_alive": -1,
-                "options": {"temperature": 0},
-            },
-            timeout=60,
-        )
+        with _CALL_SLOTS:
+            resp = _post_json("/api/generate", payload, timeout=60)
         resp.raise_for_status()
-        return resp.json()["response"]
+        return orjson.loads(resp.content)["response"]
     except Exception as e:
         raise Exception(f"Vision API failed: {e}") from e
 
 
-def generate_text(prompt: str) -> str:
+def generate_text(prompt: str, response_format: str | dict | None = None) -> str:
     """Generate a text-only response from the model.
 
     POSTs to {BASE_URL}/api/generate with model, prompt, and stream=False.
@@ -80,32 +157,54 @@ def generate_text(prompt: str) -> str:
 
     Args:
         prompt: Text prompt for the model.
+        response_format: Optional Ollama "format": "json" or a JSON schema,
+            to constrain decoding to valid JSON.
 
     Returns:
-        The model response text from resp.json()["response"].
+        The "response" field of the JSON body.
 
     Raises:
         Exception: With message "Text API failed: {e}" on any request or parse error.
     """
+    payload = {
+        "model": CHAT_MODEL,
+        "prompt": prompt,
+        "stream": False,
+        "keep_alive": -1,
+        "options": {"temperature": 0.3},
+    }
+    if response_format is not None:
+        payload["format"] = response_format
     try:
-        resp = requests.post(
-            f"{BASE_URL}/api/generate",
-            json={
-                "model": CHAT_MODEL,
-                "prompt": prompt,
-                "stream": False,
-                "keep_alive": -1,
-                "options": {"temperature": 0.3},
-            },
-            timeout=60,
-        )
+        with _CALL_SLOTS:
+            resp = _post_json("/api/generate", payload, timeout=60)
         resp.raise_for_status()
-        return resp.json()["response"]
+        return orjson.loads(resp.content)["response"]
     except Exception as e:
         raise Exception(f"Text API failed: {e}") from e
 
 
-def generate_text_stream(prompt: str):
+def _iter_ndjson(resp: requests.Response):
+    """Yield each JSON object from a streamed NDJSON response body.
+
+    Reads chunks as the server flushes them (chunk_size=None never waits to
+    fill a fixed-size buffer, so tokens are not delayed) and splits them on
+    b"\n" with bytearray.find, parsing each line's bytes directly with orjson.
+    """
+    buf = bytearray()
+    for data in resp.iter_content(chunk_size=None):
+        buf += data
+        start = 0
+        while (end := buf.find(b"\n", start)) != -1:
+            if end > start:
+                yield orjson.loads(buf[start:end])
+            start = end + 1
+        del buf[:start]
+    if buf.strip():
+        yield orjson.loads(buf)
+
+
+def generate_text_stream(prompt: str) -> Iterator[str]:
     """Yield response tokens from the model as they are generated.
 
     Uses stream=True on the Ollama API and yields each token string
@@ -121,22 +220,21 @@ def generate_text_stream(prompt: str):
         Exception: With message "Text stream API failed: {e}" on error.
     """
     try:
-        resp = requests.post(
-            f"{BASE_URL}/api/generate",
-            json={
-                "model": CHAT_MODEL,
-                "prompt": prompt,
-                "stream": True,
-                "keep_alive": -1,
-                "options": {"temperature": 0.3},
-            },
-            stream=True,
-            timeout=120,
-        )
-        resp.raise_for_status()
-        for line in resp.iter_lines():
-            if line:
-                chunk = json.loads(line)
+        with _CALL_SLOTS:
+            resp = _post_json(
+                "/api/generate",
+                {
+                    "model": CHAT_MODEL,
+                    "prompt": prompt,
+                    "stream": True,
+                    "keep_alive": -1,
+                    "options": {"temperature": 0.3},
+                },
+                stream=True,
+                timeout=120,
+            )
+            resp.raise_for_status()
+            for chunk in _iter_ndjson(resp):
                 token = chunk.get("response", "")
                 if token:
                     yield token
@@ -163,22 +261,21 @@ def generate_chat_stream(messages: list[dict]):
         Exception: With message "Chat stream API failed: {e}" on error.
     """
     try:
-        resp = requests.post(
-            f"{BASE_URL}/api/chat",
-            json={
-                "model": CHAT_MODEL,
-                "messages": messages,
-                "stream": True,
-                "keep_alive": -1,
-                "options": {"temperature": 0.3},
-            },
-            stream=True,
-            timeout=120,
-        )
-        resp.raise_for_status()
-        for line in resp.iter_lines():
-            if line:
-                chunk = json.loads(line)
+        with _CALL_SLOTS:
+            resp = _post_json(
+                "/api/chat",
+                {
+                    "model": CHAT_MODEL,
+                    "messages": messages,
+                    "stream": True,
+                    "keep_alive": -1,
+                    "options": {"temperature": 0.3},
+                },
+                stream=True,
+                timeout=120,
+            )
+            resp.raise_for_status()
+            for chunk in _iter_ndjson(resp):
                 token = chunk.get("message", {}).get("content", "")
                 if token:
                     yield token